@@ -3,38 +3,71 @@ ImagineRead Lite - Configuration
 """
 import os
 from pathlib import Path
-from dotenv import load_dotenv
+from types import MappingProxyType
+from typing import Final
+from dotenv import dotenv_values
 
-load_dotenv()
+# Parse .env once; real environment variables take precedence
+_env = {
+    **{key: value for key, value in dotenv_values().items() if value is not None},
+    **os.environ,
+}
+
+# Google client libraries read credentials straight from os.environ
+if "GOOGLE_APPLICATION_CREDENTIALS" in _env:
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", _env["GOOGLE_APPLICATION_CREDENTIALS"])
 
 # Google Cloud
-GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT", "")
-GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "imagineread-lite-uploads")
+GOOGLE_CLOUD_PROJECT: Final = _env.get("GOOGLE_CLOUD_PROJECT", "")
+GCS_BUCKET_NAME: Final = _env.get("GCS_BUCKET_NAME", "imagineread-lite-uploads")
+
+# Cloudflare R2
+R2_ENDPOINT: Final = _env.get("R2_ENDPOINT", "https://2f9439b823aea204b0ddc2eb39f90cc7.r2.cloudflarestorage.com")
+R2_ACCESS_KEY: Final = _env.get("R2_ACCESS_KEY", "")
+R2_SECRET_KEY: Final = _env.get("R2_SECRET_KEY", "")
+R2_BUCKET_NAME: Final = _env.get("R2_BUCKET_NAME", "imagineread-lite")
 
 # Redis
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_HOST: Final = _env.get("REDIS_HOST", "localhost")
+REDIS_PORT: Final = int(_env.get("REDIS_PORT", "6379"))
 
 # App Config
-ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
-FREE_FILE_SIZE_LIMIT_MB = int(os.getenv("FREE_FILE_SIZE_LIMIT_MB", "50"))
-PREMIUM_FILE_SIZE_LIMIT_MB = int(os.getenv("PREMIUM_FILE_SIZE_LIMIT_MB", "100"))
-FREE_EXPIRY_HOURS = int(os.getenv("FREE_EXPIRY_HOURS", "24"))
+ENVIRONMENT: Final = _env.get("ENVIRONMENT", "development")
+FREE_FILE_SIZE_LIMIT_MB: Final = int(_env.get("FREE_FILE_SIZE_LIMIT_MB", "50"))
+PREMIUM_FILE_SIZE_LIMIT_MB: Final = int(_env.get("PREMIUM_FILE_SIZE_LIMIT_MB", "100"))
+FREE_EXPIRY_HOURS: Final = int(_env.get("FREE_EXPIRY_HOURS", "24"))
+
+# Age at which the bucket lifecycle rule deletes objects under free/
+FREE_STORAGE_RETENTION_HOURS: Final = int(_env.get("FREE_STORAGE_RETENTION_HOURS", "24"))
+
+# Storage backend ("local" or "r2"); defaults to local storage in development
+STORAGE_BACKEND: Final = _env.get("STORAGE_BACKEND") or ("local" if ENVIRONMENT == "development" else "r2")
+
+# Serve /assets from the app; disable when a reverse proxy or CDN serves them
+SERVE_STATIC_ASSETS: Final = _env.get("SERVE_STATIC_ASSETS", "true").lower() == "true"
 
 # Derived
-FREE_FILE_SIZE_LIMIT_BYTES = FREE_FILE_SIZE_LIMIT_MB * 1024 * 1024
-PREMIUM_FILE_SIZE_LIMIT_BYTES = PREMIUM_FILE_SIZE_LIMIT_MB * 1024 * 1024
+FREE_FILE_SIZE_LIMIT_BYTES: Final = FREE_FILE_SIZE_LIMIT_MB * 1024 * 1024
+PREMIUM_FILE_SIZE_LIMIT_BYTES: Final = PREMIUM_FILE_SIZE_LIMIT_MB * 1024 * 1024
 
 # Allowed file types
-ALLOWED_EXTENSIONS = {"pdf", "cbz", "cbr", "epub"}
-ALLOWED_MIME_TYPES = {
+ALLOWED_EXTENSIONS = frozenset({"pdf", "cbz", "cbr", "epub"})
+ALLOWED_MIME_TYPES = MappingProxyType({
     "application/pdf": "pdf",
     "application/x-cbz": "cbz",
     "application/x-cbr": "cbr",
     "application/epub+zip": "epub",
     "application/zip": "cbz",  # CBZ is often detected as zip
     "application/x-rar-compressed": "cbr",
-}
+})
+
+# Content type served/stored for each allowed extension
+CONTENT_TYPES = MappingProxyType({
+    "pdf": "application/pdf",
+    "cbz": "application/x-cbz",
+    "cbr": "application/x-cbr",
+    "epub": "application/epub+zip",
+})
 
 # Paths
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -2,20 +2,45 @@
 Download Router
 Handles file retrieval by code.
 """
-from fastapi import APIRouter, HTTPException, Response
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 from loguru import logger
 from datetime import datetime
 import io
+import re
+import string
+from urllib.parse import quote
 
-from app.services.storage_service import get_storage
+from app.config import CONTENT_TYPES
+from app.services.storage_service import get_storage, LocalStorageService
 from app.services.transfer_service import get_transfers
 
 
 router = APIRouter(prefix="/api", tags=["Download"])
 
+# Upper-cases letters and drops display hyphens in a single pass
+_NORMALIZE = str.maketrans(string.ascii_lowercase, string.ascii_uppercase, "-")
+
+# Codes use the generator alphabet (no 0, O, I, 1, L)
+_CODE_PATTERN = re.compile(r"[A-HJKMNP-Z2-9]{8,10}")
+
+
+def content_disposition(filename: str) -> str:
+    """Build an attachment header the way FileResponse does (RFC 5987 for non-ASCII names)."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def normalize_code(code: str) -> Optional[str]:
+    """Normalize a user-entered code, or return None if it can't be valid."""
+    code = code.translate(_NORMALIZE)
+    return code if _CODE_PATTERN.fullmatch(code) else None
+
 
 class FileInfoResponse(BaseModel):
     """Response model for file info."""
@@ -36,17 +61,17 @@ class ErrorResponse(BaseModel):
 
 
 @router.get("/file/{code}", response_model=FileInfoResponse)
-async def get_file_info(code: str):
+async def get_file_info(code: str, background_tasks: BackgroundTasks):
     """
     Get file information and download URL by code.
     
     - Returns file metadata and a signed download URL
-    - Increments download counter
+    - Increments download counter (after the response is sent)
     """
-    code = code.upper().replace("-", "")  # Normalize code
+    code = normalize_code(code)
     
     transfer_service = get_transfers()
-    transfer = transfer_service.get(code)
+    transfer = await transfer_service.get(code) if code else None
     
     if not transfer:
         raise HTTPException(
@@ -61,16 +86,17 @@ async def get_file_info(code: str):
             detail="This transfer has expired. Files are available for 24 hours."
         )
     
-    # Get download URL
-    storage = get_storage()
-    download_url = storage.get_download_url(transfer.storage_path)
+    # Stored objects can be shared by transfers with identical content,
+    # so the URL is built from this transfer's code, not the storage path
+    download_url = f"/api/download/{code}"
     
     # Increment download count
-    transfer_service.increment_download_count(code)
+    background_tasks.add_task(transfer_service.increment_download_count, code)
     
     logger.info(f"📥 File info requested: {code}")
     
-    return FileInfoResponse(
+    # Fields are already validated; skip re-validation and serialize in Rust
+    response = FileInfoResponse.model_construct(
         success=True,
         code=code,
         originalName=transfer.original_name,
@@ -80,19 +106,20 @@ async def get_file_info(code: str):
         expiresAt=transfer.expires_at.isoformat() if transfer.expires_at else None,
         downloadCount=transfer.download_count + 1
     )
+    return Response(content=response.model_dump_json(), media_type="application/json")
 
 
 @router.get("/download/{code}")
-async def download_file(code: str):
+async def download_file(code: str, background_tasks: BackgroundTasks):
     """
     Direct file download endpoint (for local development).
     
     In production, use the signed URL from /file/{code} instead.
     """
-    code = code.upper().replace("-", "")
+    code = normalize_code(code)
     
     transfer_service = get_transfers()
-    transfer = transfer_service.get(code)
+    transfer = await transfer_service.get(code) if code else None
     
     if not transfer:
         raise HTTPException(status_code=404, detail="Code not found")
@@ -101,30 +128,45 @@ async def download_file(code: str):
         raise HTTPException(status_code=410, detail="Transfer expired")
     
     storage = get_storage()
-    file_content = storage.get_file(transfer.storage_path)
     
-    if not file_content:
+    # Determine content type
+    content_type = CONTENT_TYPES.get(transfer.file_type, "application/octet-stream")
+    
+    # Local files are sent straight from disk (sendfile where available)
+    if isinstance(storage, LocalStorageService):
+        file_path = storage.get_file_path(transfer.storage_path)
+        
+        if not file_path:
+            raise HTTPException(status_code=404, detail="File not found in storage")
+        
+        background_tasks.add_task(transfer_service.increment_download_count, code)
+        logger.info(f"📥 File downloaded: {code} - {transfer.original_name}")
+        
+        return FileResponse(
+            path=file_path,
+            media_type=content_type,
+            filename=transfer.original_name
+        )
+    
+    # Remote files are streamed chunk by chunk as they arrive
+    stored = await run_in_threadpool(storage.iter_file, transfer.storage_path)
+    
+    if stored is None:
         raise HTTPException(status_code=404, detail="File not found in storage")
     
-    # Determine content type
-    content_types = {
-        "pdf": "application/pdf",
-        "cbz": "application/x-cbz",
-        "cbr": "application/x-cbr",
-        "epub": "application/epub+zip"
-    }
-    content_type = content_types.get(transfer.file_type, "application/octet-stream")
+    chunks, content_length = stored
     
     # Increment download count
-    transfer_service.increment_download_count(code)
+    background_tasks.add_task(transfer_service.increment_download_count, code)
     
     logger.info(f"📥 File downloaded: {code} - {transfer.original_name}")
     
-    return Response(
-        content=file_content,
+    return StreamingResponse(
+        chunks,
         media_type=content_type,
         headers={
-            "Content-Disposition": f'attachment; filename="{transfer.original_name}"'
+            "Content-Disposition": content_disposition(transfer.original_name),
+            "Content-Length": str(content_length)
         }
     )
 
@@ -136,20 +178,21 @@ async def check_code(code: str):
     
     Useful for mobile app to validate before downloading.
     """
-    code = code.upper().replace("-", "")
+    code = normalize_code(code)
     
     transfer_service = get_transfers()
-    transfer = transfer_service.get(code)
+    transfer = await transfer_service.get(code) if code else None
     
     if not transfer:
-        return {"valid": False, "reason": "not_found"}
+        return JSONResponse({"valid": False, "reason": "not_found"})
     
     if transfer.is_expired():
-        return {"valid": False, "reason": "expired"}
+        return JSONResponse({"valid": False, "reason": "expired"})
     
-    return {
+    # Plain JSON types; returning JSONResponse skips jsonable_encoder
+    return JSONResponse({
         "valid": True,
         "fileName": transfer.original_name,
         "fileType": transfer.file_type,
         "fileSizeBytes": transfer.file_size_bytes
-    }
+    })
@@ -2,23 +2,68 @@
 Upload Router
 Handles file uploads and generates access codes.
 """
+import hashlib
 import io
-from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+import sys
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, Coroutine, Any
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
 from pydantic import BaseModel
 from loguru import logger
 
 from app.config import (
+    FREE_FILE_SIZE_LIMIT_MB,
     FREE_FILE_SIZE_LIMIT_BYTES,
+    FREE_STORAGE_RETENTION_HOURS,
     ALLOWED_EXTENSIONS,
     ALLOWED_MIME_TYPES
 )
 from app.services.code_generator import generate_code, format_code_for_display
 from app.services.storage_service import get_storage
-from app.services.transfer_service import get_transfers, Transfer
+from app.services.transfer_service import get_transfers, Transfer, FREE_EXPIRY_DELTA
 
 
-router = APIRouter(prefix="/api", tags=["Upload"])
+# Allowance for multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Free objects are removed this long after they were uploaded
+FREE_STORAGE_RETENTION = timedelta(hours=FREE_STORAGE_RETENTION_HOURS)
+
+# An object can only be shared if it outlives a transfer created after it;
+# otherwise hashing uploads buys nothing
+DEDUP_ENABLED = FREE_STORAGE_RETENTION > FREE_EXPIRY_DELTA
+
+
+class ContentLengthLimitRoute(APIRoute):
+    """
+    Route that rejects oversized requests before the body is parsed.
+    
+    FastAPI parses form bodies before resolving dependencies, so the
+    Content-Length check has to wrap the route handler itself.
+    """
+    
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        route_handler = super().get_route_handler()
+        
+        async def limited_route_handler(request: Request) -> Response:
+            check_content_length(request)
+            return await route_handler(request)
+        
+        return limited_route_handler
+
+
+router = APIRouter(prefix="/api", tags=["Upload"], route_class=ContentLengthLimitRoute)
+
+# Interned extension strings, shared by every upload
+_EXT_INTERN = {ext: sys.intern(ext) for ext in ALLOWED_EXTENSIONS}
+
+# Error messages built once at import
+_EXT_ERROR_TMPL = "File type '.%s' not allowed. Allowed: " + ", ".join(sorted(ALLOWED_EXTENSIONS))
+_SIZE_ERROR_FREE = f"File too large. Maximum size: {FREE_FILE_SIZE_LIMIT_MB}MB"
+_SIZE_ERROR_PREMIUM = f"File too large. Maximum size: {FREE_FILE_SIZE_LIMIT_MB * 10}MB"
 
 
 class UploadResponse(BaseModel):
@@ -35,9 +80,8 @@ class UploadResponse(BaseModel):
 
 def get_file_extension(filename: str) -> str:
     """Extract file extension from filename."""
-    if '.' not in filename:
-        return ""
-    return filename.rsplit('.', 1)[1].lower()
+    _, dot, extension = filename.rpartition('.')
+    return extension.lower() if dot else ""
 
 
 def validate_file_type(filename: str, content_type: str) -> str:
@@ -50,10 +94,10 @@ def validate_file_type(filename: str, content_type: str) -> str:
     extension = get_file_extension(filename)
     
     # Check extension
-    if extension not in ALLOWED_EXTENSIONS:
+    if extension not in _EXT_INTERN:
         raise HTTPException(
             status_code=400,
-            detail=f"File type '.{extension}' not allowed. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+            detail=_EXT_ERROR_TMPL % extension
         )
     
     # Check MIME type (if provided)
@@ -61,7 +105,7 @@ def validate_file_type(filename: str, content_type: str) -> str:
         # Allow through if extension is valid (some browsers send wrong MIME)
         logger.warning(f"Unknown MIME type: {content_type}, but extension is valid: {extension}")
     
-    return extension
+    return _EXT_INTERN[extension]
 
 
 def validate_file_size(file_size: int, is_premium: bool = False) -> None:
@@ -71,16 +115,67 @@ def validate_file_size(file_size: int, is_premium: bool = False) -> None:
     Raises:
         HTTPException: If file is too large
     """
-    limit = FREE_FILE_SIZE_LIMIT_BYTES if not is_premium else FREE_FILE_SIZE_LIMIT_BYTES * 10
+    free_limit = FREE_FILE_SIZE_LIMIT_BYTES
+    limit = free_limit if not is_premium else free_limit * 10
     
     if file_size > limit:
-        limit_mb = limit / (1024 * 1024)
         raise HTTPException(
             status_code=413,
-            detail=f"File too large. Maximum size: {limit_mb}MB"
+            detail=_SIZE_ERROR_PREMIUM if is_premium else _SIZE_ERROR_FREE
         )
 
 
+def check_content_length(request: Request, is_premium: bool = False) -> None:
+    """
+    Validate the declared request size before reading the body.
+    
+    Requests without a Content-Length header (chunked uploads) are
+    still checked against the actual file size after parsing.
+    
+    Raises:
+        HTTPException: If the declared body is too large
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit():
+        validate_file_size(int(content_length) - MULTIPART_OVERHEAD_BYTES, is_premium)
+
+
+def compute_content_hash(file_obj: BinaryIO) -> str:
+    """Compute SHA-256 of an upload and rewind it for storage."""
+    file_obj.seek(0)
+    digest = hashlib.file_digest(file_obj, "sha256").hexdigest()
+    file_obj.seek(0)
+    return digest
+
+
+def can_reuse_object(existing: Transfer, expires_at: datetime) -> bool:
+    """
+    Check whether an existing transfer's stored object outlives a new transfer.
+    
+    `existing` must be the transfer that uploaded the object, since the
+    lifecycle rule counts from the object's upload time.
+    """
+    if existing.is_premium or not existing.uploaded_object():
+        return False
+    return existing.created_at + FREE_STORAGE_RETENTION >= expires_at
+
+
+def build_upload_response(transfer: Transfer) -> Response:
+    """Serialize the upload response for a stored transfer."""
+    # Fields are already validated; skip re-validation and serialize in Rust
+    response = UploadResponse.model_construct(
+        success=True,
+        code=transfer.code,
+        codeFormatted=format_code_for_display(transfer.code),
+        originalName=transfer.original_name,
+        fileType=transfer.file_type,
+        fileSizeBytes=transfer.file_size_bytes,
+        expiresAt=transfer.expires_at.isoformat() if transfer.expires_at else None,
+        message="File uploaded successfully!"
+    )
+    return Response(content=response.model_dump_json(), media_type="application/json")
+
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
@@ -97,32 +192,45 @@ async def upload_file(
         # Validate file type
         file_type = validate_file_type(file.filename, file.content_type)
         
-        # Read file content
-        content = await file.read()
-        file_size = len(content)
+        # Measure the spooled upload without reading it into memory
+        file.file.seek(0, io.SEEK_END)
+        file_size = file.file.tell()
+        file.file.seek(0)
         
         # Validate size
         validate_file_size(file_size, is_premium=False)
         
-        # Generate unique code
+        # Identical content may share a stored object, but every upload
+        # gets its own code and full lifetime
         transfer_service = get_transfers()
-        existing_codes = transfer_service.get_all_codes()
-        code = generate_code()
+        content_hash = None
+        existing = None
+        if DEDUP_ENABLED:
+            content_hash = await run_in_threadpool(compute_content_hash, file.file)
+            existing = await transfer_service.find_by_hash(content_hash)
+        created_at = datetime.utcnow()
         
-        # Ensure uniqueness (very rare case)
-        attempts = 0
-        while code in existing_codes and attempts < 10:
+        # Generate unique code (collisions are very rare, so this
+        # is normally a single point lookup)
+        for _ in range(10):
             code = generate_code()
-            attempts += 1
+            if not await transfer_service.exists(code):
+                break
         
-        # Upload to storage
-        storage = get_storage()
-        storage_path = storage.upload_file(
-            file_content=content,
-            code=code,
-            filename=file.filename,
-            is_premium=False
-        )
+        # Upload to storage, unless the same content is already stored
+        # for at least as long as this transfer lives
+        if existing and can_reuse_object(existing, created_at + FREE_EXPIRY_DELTA):
+            storage_path = existing.storage_path
+            logger.info(f"♻️ Duplicate content, reusing stored object: {storage_path}")
+        else:
+            storage = get_storage()
+            storage_path = await storage.upload_file(
+                file_obj=file.file,
+                code=code,
+                filename=file.filename,
+                file_type=file_type,
+                is_premium=False
+            )
         
         # Create transfer record
         transfer = Transfer(
@@ -131,23 +239,16 @@ async def upload_file(
             file_type=file_type,
             file_size_bytes=file_size,
             storage_path=storage_path,
-            is_premium=False
+            is_premium=False,
+            created_at=created_at,
+            content_hash=content_hash
         )
         
-        transfer_service.create(transfer)
+        await transfer_service.create(transfer)
         
         logger.info(f"✅ Upload complete: {code} - {file.filename} ({file_size} bytes)")
         
-        return UploadResponse(
-            success=True,
-            code=code,
-            codeFormatted=format_code_for_display(code),
-            originalName=file.filename,
-            fileType=file_type,
-            fileSizeBytes=file_size,
-            expiresAt=transfer.expires_at.isoformat() if transfer.expires_at else None,
-            message="File uploaded successfully!"
-        )
+        return build_upload_response(transfer)
         
     except HTTPException:
         raise
@@ -6,6 +6,16 @@ import secrets
 import string
 from datetime import datetime
 
+# Uppercase letters and digits without ambiguous characters (0, O, I, 1, L)
+ALPHABET = b"ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+
+# Bytes >= this value are rejected so every symbol is equally likely
+_ACCEPT_LIMIT = 256 - 256 % len(ALPHABET)
+
+# Translation table mapping accepted random bytes to alphabet symbols
+_BYTE_TO_SYMBOL = bytes(ALPHABET[b % len(ALPHABET)] for b in range(256))
+_REJECTED_BYTES = bytes(range(_ACCEPT_LIMIT, 256))
+
 
 def generate_code(length: int = 8) -> str:
     """
@@ -20,9 +30,11 @@ def generate_code(length: int = 8) -> str:
     Returns:
         Alphanumeric code string
     """
-    # Remove ambiguous characters for easier manual entry
-    alphabet = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
+    # Draw all randomness at once; rejected bytes are dropped by translate
+    code = b""
+    while len(code) < length:
+        code += secrets.token_bytes(length * 2).translate(_BYTE_TO_SYMBOL, _REJECTED_BYTES)
+    return code[:length].decode()
 
 
 def generate_unique_code(existing_codes: set | None = None, length: int = 8) -> str:
@@ -59,8 +71,14 @@ def format_code_for_display(code: str) -> str:
     Returns:
         Formatted code with hyphens
     """
-    if len(code) <= 4:
+    length = len(code)
+    
+    # Fast path: generated codes are 8 characters
+    if length == 8:
+        return f"{code[:4]}-{code[4:]}"
+    
+    if length <= 4:
         return code
     
-    mid = len(code) // 2
+    mid = length // 2
     return f"{code[:mid]}-{code[mid:]}"
@@ -4,22 +4,49 @@ Handles file storage operations with Cloudflare R2 (S3-compatible).
 For local development, uses file system storage.
 """
 import os
+import shutil
+from functools import lru_cache
 from pathlib import Path
-from datetime import datetime, timedelta
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional, Tuple
 from loguru import logger
+from fastapi.concurrency import run_in_threadpool
 
 from app.config import (
-    ENVIRONMENT, 
+    STORAGE_BACKEND,
     TEMP_DIR,
-    FREE_EXPIRY_HOURS
+    CONTENT_TYPES,
+    R2_ENDPOINT,
+    R2_ACCESS_KEY,
+    R2_SECRET_KEY,
+    R2_BUCKET_NAME
 )
 
-# R2 Configuration (from environment)
-R2_ENDPOINT = os.getenv("R2_ENDPOINT", "https://2f9439b823aea204b0ddc2eb39f90cc7.r2.cloudflarestorage.com")
-R2_ACCESS_KEY = os.getenv("R2_ACCESS_KEY", "")
-R2_SECRET_KEY = os.getenv("R2_SECRET_KEY", "")
-R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME", "imagineread-lite")
+# Chunk size used when copying uploads to storage
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Multipart settings for R2 uploads
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Chunk size used when streaming downloads from R2
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Connections kept open to R2 and shared across requests
+R2_MAX_POOL_CONNECTIONS = 64
+
+
+def _drop_page_cache(fd: int) -> None:
+    """
+    Flush a written file to disk and drop it from the page cache.
+    
+    Uploads are usually read back much later (if at all), so keeping
+    them cached only crowds out other data. No-op where posix_fadvise
+    is unavailable (e.g. macOS).
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    os.fsync(fd)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
 
 
 class LocalStorageService:
@@ -30,26 +57,38 @@ class LocalStorageService:
         self.base_path.mkdir(parents=True, exist_ok=True)
         logger.info(f"📁 LocalStorage initialized at: {self.base_path}")
     
-    def upload_file(
+    async def upload_file(
         self, 
-        file_content: bytes, 
+        file_obj: BinaryIO, 
         code: str, 
         filename: str,
+        file_type: str,
         is_premium: bool = False
     ) -> str:
-        """Upload file to local storage."""
+        """Upload file to local storage, copying it in chunks."""
         tier = "premium" if is_premium else "free"
-        file_dir = self.base_path / tier / code
-        file_dir.mkdir(parents=True, exist_ok=True)
+        file_path = self.base_path / tier / code / filename
         
-        file_path = file_dir / filename
-        file_path.write_bytes(file_content)
+        # Disk IO runs in the threadpool so the event loop stays free
+        file_size = await run_in_threadpool(self._write_file, file_path, file_obj)
         
         storage_path = f"{tier}/{code}/{filename}"
-        logger.info(f"📤 Uploaded: {storage_path} ({len(file_content)} bytes)")
+        logger.info(f"📤 Uploaded: {storage_path} ({file_size} bytes)")
         
         return storage_path
     
+    def _write_file(self, file_path: Path, file_obj: BinaryIO) -> int:
+        """Copy upload to disk and return its size in bytes."""
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        with file_path.open("wb") as dest:
+            shutil.copyfileobj(file_obj, dest, length=UPLOAD_CHUNK_SIZE)
+            file_size = dest.tell()
+            dest.flush()
+            _drop_page_cache(dest.fileno())
+        
+        return file_size
+    
     def get_file(self, storage_path: str) -> Optional[bytes]:
         """Get file from local storage."""
         file_path = self.base_path / storage_path
@@ -60,6 +99,16 @@ class LocalStorageService:
         
         return file_path.read_bytes()
     
+    def get_file_path(self, storage_path: str) -> Optional[Path]:
+        """Get path of file in local storage (None if missing)."""
+        file_path = self.base_path / storage_path
+        
+        if not file_path.is_file():
+            logger.warning(f"📭 File not found: {storage_path}")
+            return None
+        
+        return file_path
+    
     def get_download_url(self, storage_path: str, expiry_minutes: int = 60) -> str:
         """Get download URL for file (local dev uses API path)."""
         parts = storage_path.split("/")
@@ -94,6 +143,7 @@ class R2StorageService:
     def __init__(self):
         try:
             import boto3
+            from boto3.s3.transfer import TransferConfig
             from botocore.config import Config
             
             self.client = boto3.client(
@@ -103,41 +153,46 @@ class R2StorageService:
                 aws_secret_access_key=R2_SECRET_KEY,
                 config=Config(
                     signature_version='s3v4',
-                    s3={'addressing_style': 'path'}
+                    s3={'addressing_style': 'path'},
+                    max_pool_connections=R2_MAX_POOL_CONNECTIONS,
+                    retries={'max_attempts': 3, 'mode': 'standard'},
+                    tcp_keepalive=True
                 )
             )
+            self.transfer_config = TransferConfig(
+                multipart_threshold=MULTIPART_THRESHOLD,
+                multipart_chunksize=MULTIPART_CHUNK_SIZE,
+                use_threads=True
+            )
             self.bucket_name = R2_BUCKET_NAME
             logger.info(f"☁️ R2 initialized: {R2_BUCKET_NAME}")
         except Exception as e:
             logger.error(f"❌ Failed to initialize R2: {e}")
             raise
     
-    def upload_file(
+    async def upload_file(
         self, 
-        file_content: bytes, 
+        file_obj: BinaryIO, 
         code: str, 
         filename: str,
+        file_type: str,
         is_premium: bool = False
     ) -> str:
-        """Upload file to R2."""
+        """Upload file to R2 (multipart for large files)."""
         tier = "premium" if is_premium else "free"
         storage_path = f"{tier}/{code}/{filename}"
         
         # Determine content type
-        ext = filename.lower().split('.')[-1]
-        content_types = {
-            'pdf': 'application/pdf',
-            'epub': 'application/epub+zip',
-            'cbz': 'application/x-cbz',
-            'cbr': 'application/x-cbr',
-        }
-        content_type = content_types.get(ext, 'application/octet-stream')
+        content_type = CONTENT_TYPES.get(file_type, 'application/octet-stream')
         
-        self.client.put_object(
-            Bucket=self.bucket_name,
-            Key=storage_path,
-            Body=file_content,
-            ContentType=content_type
+        # boto3 is blocking; keep the event loop free while the upload runs
+        await run_in_threadpool(
+            self.client.upload_fileobj,
+            file_obj,
+            self.bucket_name,
+            storage_path,
+            ExtraArgs={'ContentType': content_type},
+            Config=self.transfer_config
         )
         
         logger.info(f"☁️ Uploaded to R2: {storage_path}")
@@ -157,6 +212,33 @@ class R2StorageService:
             logger.error(f"❌ Failed to get file from R2: {e}")
             return None
     
+    def iter_file(
+        self, 
+        storage_path: str, 
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE
+    ) -> Optional[Tuple[Iterator[bytes], int]]:
+        """Get file from R2 as an iterator of chunks and its size (None if missing)."""
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket_name,
+                Key=storage_path
+            )
+        except self.client.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            logger.error(f"❌ Failed to get file from R2: {e}")
+            return None
+        
+        return self._iter_body(response['Body'], chunk_size), response['ContentLength']
+    
+    @staticmethod
+    def _iter_body(body, chunk_size: int) -> Iterator[bytes]:
+        """Yield body chunks, releasing the connection even if the client disconnects."""
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+    
     def get_download_url(self, storage_path: str, expiry_minutes: int = 60) -> str:
         """
         Get download URL.
@@ -209,23 +291,25 @@ class R2StorageService:
             return False
 
 
+# Storage backends by STORAGE_BACKEND name
+_BACKENDS = {
+    "local": LocalStorageService,
+    "r2": R2StorageService,
+}
+
+
 def get_storage_service():
     """
-    Factory function to get the appropriate storage service.
+    Factory function to get the storage service selected by STORAGE_BACKEND.
     """
-    if ENVIRONMENT == "development":
-        return LocalStorageService()
-    else:
-        return R2StorageService()
-
-
-# Singleton instance
-_storage_service = None
+    try:
+        backend = _BACKENDS[STORAGE_BACKEND]
+    except KeyError:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND!r}") from None
+    return backend()
 
 
+@lru_cache(maxsize=1)
 def get_storage():
     """Get singleton storage service instance."""
-    global _storage_service
-    if _storage_service is None:
-        _storage_service = get_storage_service()
-    return _storage_service
+    return get_storage_service()
@@ -1,19 +1,69 @@
 """
 Transfer Service
-Manages transfer metadata in database (Firestore or local JSON for dev).
+Manages transfer metadata in database (Firestore or local SQLite for dev).
 """
-import json
+import sqlite3
+import threading
+import time
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, List
+import orjson
+from fastapi.concurrency import run_in_threadpool
 from loguru import logger
 
-from app.config import ENVIRONMENT, TEMP_DIR, FREE_EXPIRY_HOURS
+from app.config import ENVIRONMENT, TEMP_DIR, FREE_EXPIRY_HOURS, GOOGLE_CLOUD_PROJECT
+
+# Only needed in production; development runs on SQLite without it
+try:
+    from google.cloud import firestore
+except ImportError:
+    firestore = None
+
+# Lifetime of a free transfer, built once rather than per Transfer
+FREE_EXPIRY_DELTA = timedelta(hours=FREE_EXPIRY_HOURS)
+
+# Transfers fetched from Firestore are reused for this long.
+# The cache is per worker process: delete/delete_many only clear it in the
+# worker that ran them, so other workers may serve a deleted transfer for up
+# to this TTL. Accepted trade-off: deletes come from the expiry sweep, and
+# cached transfers still enforce their own expiry through is_expired().
+TRANSFER_CACHE_TTL_SECONDS = 5
+TRANSFER_CACHE_SIZE = 1024
+
+# Maximum number of writes Firestore accepts in one batch commit
+FIRESTORE_BATCH_SIZE = 500
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """Parse a stored timestamp (ISO string or native datetime) as naive UTC."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    return datetime.fromisoformat(value)
 
 
 class Transfer:
     """Transfer model."""
     
+    __slots__ = (
+        "code",
+        "original_name",
+        "file_type",
+        "file_size_bytes",
+        "storage_path",
+        "is_premium",
+        "user_id",
+        "created_at",
+        "expires_at",
+        "expires_at_epoch",
+        "download_count",
+        "content_hash",
+    )
+    
     def __init__(
         self,
         code: str,
@@ -25,7 +75,9 @@ class Transfer:
         user_id: Optional[str] = None,
         created_at: Optional[datetime] = None,
         expires_at: Optional[datetime] = None,
-        download_count: int = 0
+        download_count: int = 0,
+        content_hash: Optional[str] = None,
+        expires_at_epoch: Optional[int] = None
     ):
         self.code = code
         self.original_name = original_name
@@ -38,11 +90,17 @@ class Transfer:
         
         # Set expiry for free tier
         if expires_at is None and not is_premium:
-            self.expires_at = self.created_at + timedelta(hours=FREE_EXPIRY_HOURS)
+            self.expires_at = self.created_at + FREE_EXPIRY_DELTA
         else:
             self.expires_at = expires_at
         
+        # Expiry as UNIX seconds, so is_expired is a plain integer compare
+        if expires_at_epoch is None and self.expires_at is not None:
+            expires_at_epoch = int(self.expires_at.replace(tzinfo=timezone.utc).timestamp())
+        self.expires_at_epoch = expires_at_epoch
+        
         self.download_count = download_count
+        self.content_hash = content_hash
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary."""
@@ -56,14 +114,16 @@ class Transfer:
             "userId": self.user_id,
             "createdAt": self.created_at.isoformat(),
             "expiresAt": self.expires_at.isoformat() if self.expires_at else None,
-            "downloadCount": self.download_count
+            "expiresAtEpoch": self.expires_at_epoch,
+            "downloadCount": self.download_count,
+            "contentHash": self.content_hash
         }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "Transfer":
         """Create from dictionary."""
-        created_at = datetime.fromisoformat(data["createdAt"]) if data.get("createdAt") else None
-        expires_at = datetime.fromisoformat(data["expiresAt"]) if data.get("expiresAt") else None
+        created_at = _parse_timestamp(data.get("createdAt"))
+        expires_at = _parse_timestamp(data.get("expiresAt"))
         
         return cls(
             code=data["code"],
@@ -75,102 +135,174 @@ class Transfer:
             user_id=data.get("userId"),
             created_at=created_at,
             expires_at=expires_at,
-            download_count=data.get("downloadCount", 0)
+            download_count=data.get("downloadCount", 0),
+            content_hash=data.get("contentHash"),
+            expires_at_epoch=data.get("expiresAtEpoch")
         )
     
     def is_expired(self) -> bool:
         """Check if transfer is expired."""
-        if self.expires_at is None:
+        if self.expires_at_epoch is None:
             return False
-        return datetime.utcnow() > self.expires_at
+        return time.time() > self.expires_at_epoch
+    
+    def uploaded_object(self) -> bool:
+        """Check if this transfer uploaded its stored object (rather than reusing one)."""
+        return f"/{self.code}/" in self.storage_path
 
 
 class LocalTransferService:
-    """Local JSON-based transfer service for development."""
+    """Local SQLite-based transfer service for development."""
     
     def __init__(self):
-        self.db_path = TEMP_DIR / "transfers.json"
+        self.db_path = TEMP_DIR / "transfers.db"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.db_path,
+            isolation_level=None,
+            check_same_thread=False
+        )
         self._ensure_db()
         logger.info(f"📁 LocalTransferService initialized: {self.db_path}")
     
     def _ensure_db(self):
-        """Ensure database file exists."""
-        if not self.db_path.exists():
-            self.db_path.write_text("{}")
+        """Ensure database schema exists."""
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS transfers ("
+            " code TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " expires_at_epoch INTEGER,"
+            " content_hash TEXT,"
+            " download_count INTEGER NOT NULL DEFAULT 0"
+            ")"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_transfers_expires_at_epoch ON transfers (expires_at_epoch)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_transfers_content_hash ON transfers (content_hash)")
     
-    def _load_db(self) -> Dict[str, Dict]:
-        """Load database from file."""
-        try:
-            return json.loads(self.db_path.read_text())
-        except json.JSONDecodeError:
-            return {}
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Run a query and fetch all rows."""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        """Run a statement and return the number of affected rows."""
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
     
-    def _save_db(self, data: Dict[str, Dict]):
-        """Save database to file."""
-        self.db_path.write_text(json.dumps(data, indent=2))
+    def _execute_many(self, sql: str, params: List[tuple]) -> int:
+        """Run a statement once per parameter set and return the affected rows."""
+        with self._lock:
+            return self._conn.executemany(sql, params).rowcount
     
-    def create(self, transfer: Transfer) -> Transfer:
+    @staticmethod
+    def _to_transfer(data: str, download_count: int, expires_at_epoch: Optional[int]) -> Transfer:
+        """Build transfer from a stored row."""
+        transfer_dict = orjson.loads(data)
+        transfer_dict["downloadCount"] = download_count
+        transfer_dict["expiresAtEpoch"] = expires_at_epoch
+        return Transfer.from_dict(transfer_dict)
+    
+    async def create(self, transfer: Transfer) -> Transfer:
         """Create a new transfer."""
-        db = self._load_db()
-        db[transfer.code] = transfer.to_dict()
-        self._save_db(db)
+        # Expiry checks (SQL and is_expired) all read the expires_at_epoch
+        # column; the blob keeps only the ISO expiresAt for display
+        data = transfer.to_dict()
+        del data["expiresAtEpoch"]
+        await run_in_threadpool(
+            self._execute,
+            "INSERT OR REPLACE INTO transfers (code, data, expires_at_epoch, content_hash, download_count) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                transfer.code,
+                orjson.dumps(data).decode(),
+                transfer.expires_at_epoch,
+                transfer.content_hash,
+                transfer.download_count
+            )
+        )
         logger.info(f"📝 Created transfer: {transfer.code}")
         return transfer
     
-    def get(self, code: str) -> Optional[Transfer]:
+    async def get(self, code: str) -> Optional[Transfer]:
         """Get transfer by code."""
-        db = self._load_db()
-        data = db.get(code)
+        rows = await run_in_threadpool(
+            self._query,
+            "SELECT data, download_count, expires_at_epoch FROM transfers WHERE code = ?",
+            (code,)
+        )
         
-        if not data:
+        if not rows:
             return None
         
-        return Transfer.from_dict(data)
+        return self._to_transfer(*rows[0])
     
-    def exists(self, code: str) -> bool:
+    async def exists(self, code: str) -> bool:
         """Check if code exists."""
-        db = self._load_db()
-        return code in db
+        rows = await run_in_threadpool(self._query, "SELECT 1 FROM transfers WHERE code = ?", (code,))
+        return bool(rows)
     
-    def increment_download_count(self, code: str) -> bool:
+    async def increment_download_count(self, code: str) -> bool:
         """Increment download count."""
-        db = self._load_db()
-        
-        if code not in db:
-            return False
-        
-        db[code]["downloadCount"] = db[code].get("downloadCount", 0) + 1
-        self._save_db(db)
-        return True
+        updated = await run_in_threadpool(
+            self._execute,
+            "UPDATE transfers SET download_count = download_count + 1 WHERE code = ?",
+            (code,)
+        )
+        return updated > 0
     
-    def delete(self, code: str) -> bool:
+    async def delete(self, code: str) -> bool:
         """Delete transfer."""
-        db = self._load_db()
-        
-        if code in db:
-            del db[code]
-            self._save_db(db)
+        if await run_in_threadpool(self._execute, "DELETE FROM transfers WHERE code = ?", (code,)):
             logger.info(f"🗑️ Deleted transfer: {code}")
             return True
         
         return False
     
-    def get_expired(self) -> List[Transfer]:
+    async def delete_many(self, codes: List[str]) -> int:
+        """Delete transfers in one call and return how many were removed."""
+        deleted = await run_in_threadpool(
+            self._execute_many,
+            "DELETE FROM transfers WHERE code = ?",
+            [(code,) for code in codes]
+        )
+        
+        logger.info(f"🗑️ Deleted {deleted} transfers")
+        return deleted
+    
+    async def get_expired(self) -> List[Transfer]:
         """Get all expired transfers."""
-        db = self._load_db()
-        expired = []
+        # One clock read for the whole sweep; the index range scan compares integers
+        rows = await run_in_threadpool(
+            self._query,
+            "SELECT data, download_count, expires_at_epoch FROM transfers WHERE expires_at_epoch <= ?",
+            (int(time.time()),)
+        )
+        return [self._to_transfer(*row) for row in rows]
+    
+    async def find_by_hash(self, content_hash: str) -> Optional[Transfer]:
+        """Find the most recent transfer that uploaded an object with this content."""
+        # Only the uploader's createdAt dates the object (its storage path
+        # holds its own code); ISO timestamps sort chronologically, so only
+        # the newest row is deserialized
+        rows = await run_in_threadpool(
+            self._query,
+            "SELECT data, download_count, expires_at_epoch FROM transfers "
+            "WHERE content_hash = ? AND json_extract(data, '$.storagePath') LIKE '%/' || code || '/%' "
+            "ORDER BY json_extract(data, '$.createdAt') DESC LIMIT 1",
+            (content_hash,)
+        )
         
-        for data in db.values():
-            transfer = Transfer.from_dict(data)
-            if transfer.is_expired():
-                expired.append(transfer)
+        if not rows:
+            return None
         
-        return expired
+        return self._to_transfer(*rows[0])
     
-    def get_all_codes(self) -> set:
+    async def get_all_codes(self) -> set:
         """Get all existing codes."""
-        db = self._load_db()
-        return set(db.keys())
+        rows = await run_in_threadpool(self._query, "SELECT code FROM transfers")
+        return {code for (code,) in rows}
 
 
 class FirestoreTransferService:
@@ -178,60 +310,112 @@ class FirestoreTransferService:
     
     def __init__(self):
         try:
-            from google.cloud import firestore
-            self.db = firestore.Client()
+            if firestore is None:
+                raise ImportError("google-cloud-firestore is not installed")
+            # .env values are not exported, so pass the project explicitly
+            self.db = firestore.Client(project=GOOGLE_CLOUD_PROJECT or None)
             self.collection = self.db.collection("transfers")
+            self._cache: Dict[str, tuple] = {}
             logger.info("☁️ FirestoreTransferService initialized")
         except Exception as e:
             logger.error(f"❌ Failed to initialize Firestore: {e}")
             raise
     
-    def create(self, transfer: Transfer) -> Transfer:
+    @staticmethod
+    def _to_document(transfer: Transfer) -> Dict[str, Any]:
+        """Convert to Firestore document, with a native expiry Timestamp."""
+        data = transfer.to_dict()
+        
+        # createdAt/expiresAt stay ISO strings for existing documents and
+        # the cleanup functions; get_expired queries the native Timestamp
+        data["expiresAtTimestamp"] = transfer.expires_at.replace(tzinfo=timezone.utc) if transfer.expires_at else None
+        return data
+    
+    def _cache_transfer(self, transfer: Transfer):
+        """Keep transfer in the short-lived cache."""
+        if len(self._cache) >= TRANSFER_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[transfer.code] = (time.monotonic() + TRANSFER_CACHE_TTL_SECONDS, transfer)
+    
+    async def create(self, transfer: Transfer) -> Transfer:
         """Create a new transfer."""
-        self.collection.document(transfer.code).set(transfer.to_dict())
+        await run_in_threadpool(self.collection.document(transfer.code).set, self._to_document(transfer))
+        self._cache_transfer(transfer)
         logger.info(f"☁️ Created transfer in Firestore: {transfer.code}")
         return transfer
     
-    def get(self, code: str) -> Optional[Transfer]:
-        """Get transfer by code."""
-        doc = self.collection.document(code).get()
+    async def get(self, code: str) -> Optional[Transfer]:
+        """Get transfer by code (cached for a few seconds)."""
+        cached = self._cache.get(code)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        doc = await run_in_threadpool(self.collection.document(code).get)
         
         if not doc.exists:
             return None
         
-        return Transfer.from_dict(doc.to_dict())
+        transfer = Transfer.from_dict(doc.to_dict())
+        self._cache_transfer(transfer)
+        return transfer
     
-    def exists(self, code: str) -> bool:
+    async def exists(self, code: str) -> bool:
         """Check if code exists."""
-        doc = self.collection.document(code).get()
+        # An empty field mask returns existence metadata only
+        doc = await run_in_threadpool(self.collection.document(code).get, field_paths=[])
         return doc.exists
     
-    def increment_download_count(self, code: str) -> bool:
+    async def increment_download_count(self, code: str) -> bool:
         """Increment download count."""
-        from google.cloud import firestore
-        
         doc_ref = self.collection.document(code)
-        doc_ref.update({"downloadCount": firestore.Increment(1)})
+        await run_in_threadpool(doc_ref.update, {"downloadCount": firestore.Increment(1)})
+        self._cache.pop(code, None)
         return True
     
-    def delete(self, code: str) -> bool:
+    async def delete(self, code: str) -> bool:
         """Delete transfer."""
-        self.collection.document(code).delete()
+        await run_in_threadpool(self.collection.document(code).delete)
+        self._cache.pop(code, None)
         logger.info(f"☁️ Deleted transfer from Firestore: {code}")
         return True
     
-    def get_expired(self) -> List[Transfer]:
+    async def delete_many(self, codes: List[str]) -> int:
+        """Delete transfers with batched commits (one RPC per 500 deletes)."""
+        for start in range(0, len(codes), FIRESTORE_BATCH_SIZE):
+            batch = self.db.batch()
+            for code in codes[start:start + FIRESTORE_BATCH_SIZE]:
+                batch.delete(self.collection.document(code))
+                self._cache.pop(code, None)
+            await run_in_threadpool(batch.commit)
+        
+        logger.info(f"☁️ Deleted {len(codes)} transfers from Firestore")
+        return len(codes)
+    
+    async def get_expired(self) -> List[Transfer]:
         """Get all expired transfers."""
-        now = datetime.utcnow()
+        now = datetime.now(timezone.utc)
         
-        query = self.collection.where("expiresAt", "<=", now.isoformat())
-        docs = query.stream()
+        # Timestamp range query served by the single-field expiresAtTimestamp index
+        query = self.collection.where("expiresAtTimestamp", "<=", now)
+        docs = await run_in_threadpool(list, query.stream())
         
         return [Transfer.from_dict(doc.to_dict()) for doc in docs]
     
-    def get_all_codes(self) -> set:
+    async def find_by_hash(self, content_hash: str) -> Optional[Transfer]:
+        """Find the most recent transfer that uploaded an object with this content."""
+        query = self.collection.where("contentHash", "==", content_hash)
+        docs = await run_in_threadpool(list, query.stream())
+        
+        # Only the uploader's createdAt dates the object; reusers are skipped
+        transfers = [Transfer.from_dict(doc.to_dict()) for doc in docs]
+        uploaders = [transfer for transfer in transfers if transfer.uploaded_object()]
+        return max(uploaders, key=lambda transfer: transfer.created_at, default=None)
+    
+    async def get_all_codes(self) -> set:
         """Get all existing codes."""
-        docs = self.collection.stream()
+        # Projection on the document ID only; no field data is transferred
+        query = self.collection.select([firestore.FieldPath.document_id()])
+        docs = await run_in_threadpool(list, query.stream())
         return {doc.id for doc in docs}
 
 
@@ -0,0 +1,83 @@
+"""
+Static Files
+Serves built frontend assets with precompressed variants and long-lived caching.
+"""
+import mimetypes
+from pathlib import Path
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Scope
+
+# Vite content-hashes asset filenames, so they never change in place
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Precompressed variants, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def accepted_encodings(accept_encoding: str) -> frozenset:
+    """Parse Accept-Encoding into the encodings the client accepts (q > 0)."""
+    accepted = set()
+    refused = set()
+    
+    for token in accept_encoding.lower().split(","):
+        name, _, params = token.partition(";")
+        name = name.strip()
+        if not name:
+            continue
+        
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        
+        (accepted if quality > 0 else refused).add(name)
+    
+    # A wildcard accepts every encoding the client did not refuse explicitly
+    if "*" in accepted:
+        accepted.update(encoding for encoding, _ in ENCODINGS if encoding not in refused)
+    
+    return frozenset(accepted - refused)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves build-time `.br` / `.gz` variants when the
+    client accepts them, and marks every response as immutable.
+    """
+    
+    def __init__(self, *, directory: Path, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        
+        # Variants are produced at build time, so look them up once
+        self.compressed = {
+            path.relative_to(directory).as_posix()
+            for path in Path(directory).rglob("*")
+            if path.suffix in (".br", ".gz")
+        }
+    
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        """Serve the best precompressed variant, falling back to the original."""
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted and path + suffix in self.compressed:
+                response = await super().get_response(path + suffix, scope)
+                media_type, _ = mimetypes.guess_type(path)
+                if media_type and media_type.startswith("text/"):
+                    media_type += "; charset=utf-8"
+                response.headers["Content-Type"] = media_type or "application/octet-stream"
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = await super().get_response(path, scope)
+        
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
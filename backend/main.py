@@ -1,18 +1,22 @@
 """
 ImagineRead Lite - Main Application
 """
+import hashlib
+import os
 import sys
 from pathlib import Path
 from loguru import logger
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.responses import FileResponse, Response
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
-from app.config import ENVIRONMENT, TEMP_DIR
+from app.config import ENVIRONMENT, SERVE_STATIC_ASSETS, TEMP_DIR
+from app.static_files import PrecompressedStaticFiles
+from app.services.storage_service import get_storage
 
 # Configure Loguru
 logger.remove()
@@ -32,6 +36,9 @@ async def lifespan(app: FastAPI) -> AsyncGenerator:
     logger.info(f"📁 Temp directory: {TEMP_DIR}")
     logger.info(f"🌍 Environment: {ENVIRONMENT}")
     logger.info(f"📂 Static directory: {STATIC_DIR} (exists: {STATIC_DIR.exists()})")
+    
+    # Create the storage client (and its connection pool) before the first request
+    get_storage()
     yield
     logger.info("👋 Shutting down ImagineRead Lite...")
 
@@ -69,25 +76,63 @@ app.include_router(download.router)
 
 # Serve static files (frontend assets)
 if STATIC_DIR.exists():
-    app.mount("/assets", StaticFiles(directory=STATIC_DIR / "assets"), name="assets")
+    if SERVE_STATIC_ASSETS:
+        app.mount("/assets", PrecompressedStaticFiles(directory=STATIC_DIR / "assets"), name="assets")
+    
+    # First path segments that never fall back to the SPA
+    RESERVED_SEGMENTS = frozenset({"api", "assets", "docs", "health", "openapi.json"})
+    
+    # The build output is fixed at startup, so map and stat it once
+    STATIC_FILES = {
+        path.relative_to(STATIC_DIR).as_posix(): (path, path.stat())
+        for path in STATIC_DIR.rglob("*")
+        if path.is_file()
+    }
+    
+    # index.html is tiny and changes only on deploy: keep it in memory and
+    # let browsers revalidate it with a precomputed ETag
+    INDEX_BYTES = (STATIC_DIR / "index.html").read_bytes()
+    INDEX_ETAG = f'"{hashlib.sha1(INDEX_BYTES).hexdigest()}"'
+    INDEX_HEADERS = {"ETag": INDEX_ETAG, "Cache-Control": "no-cache"}
+    
+    def serve_index(request: Request) -> Response:
+        """Serve index.html, or 304 if the client already has this version."""
+        if INDEX_ETAG in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=INDEX_HEADERS)
+        return Response(INDEX_BYTES, media_type="text/html", headers=INDEX_HEADERS)
     
     @app.get("/")
-    async def serve_frontend():
+    async def serve_frontend(request: Request):
         """Serve the React frontend."""
-        return FileResponse(STATIC_DIR / "index.html")
+        return serve_index(request)
     
-    @app.get("/{catch_all:path}")
-    async def serve_spa(catch_all: str):
+    # Runs only after routing found nothing, so matched routes pay no
+    # catch-all cost
+    @app.exception_handler(404)
+    async def serve_spa(request: Request, exc: HTTPException):
         """Serve SPA for client-side routing."""
+        path = request.url.path.lstrip("/")
+        
         # Don't catch API routes
-        if catch_all.startswith("api/") or catch_all.startswith("docs") or catch_all.startswith("health") or catch_all.startswith("openapi"):
-            return {"detail": "Not Found"}
-        file_path = STATIC_DIR / catch_all
-        if file_path.exists() and file_path.is_file():
-            return FileResponse(file_path)
-        return FileResponse(STATIC_DIR / "index.html")
+        if request.method != "GET" or path.partition("/")[0] in RESERVED_SEGMENTS:
+            return await http_exception_handler(request, exc)
+        if path in STATIC_FILES and path != "index.html":
+            file_path, stat_result = STATIC_FILES[path]
+            return FileResponse(file_path, stat_result=stat_result)
+        return serve_index(request)
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
+    if ENVIRONMENT == "development":
+        uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
+    else:
+        # One worker per core on the native event loop and HTTP parser
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8001,
+            workers=os.cpu_count(),
+            loop="uvloop",
+            http="httptools"
+        )
 